@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+FIRST_NAMES = ['John', 'Mary', 'Peter', 'Anna', 'Raj', 'Priya', 'Hans', 'Sophie', 'Luca', 'Maria',
+               'Jack', 'Emma', 'Vikram', 'Lena', 'Pierre', 'Claire', 'Tom', 'Alice', 'Arjun', 'Nina']
+LAST_NAMES = ['Smith', 'Kumar', 'Muller', 'Rossi', 'Dupont', 'Brown', 'Sharma', 'Weber', 'Martin', 'Jones']
+VERBS = ['kills', 'loves', 'meets', 'finds', 'saves', 'leaves', 'marries', 'helps', 'follows', 'attacks',
+         'discovers', 'tells', 'visits', 'escapes', 'returns', 'fights', 'kisses', 'betrays', 'rescues', 'joins']
+NOUNS = ['doctor', 'police', 'house', 'friend', 'father', 'mother', 'village', 'money', 'car', 'wife',
+         'husband', 'soldier', 'gang', 'school', 'city', 'king', 'lawyer', 'brother', 'sister', 'letter']
+ADJECTIVES = ['young', 'beautiful', 'rich', 'old', 'poor', 'brave', 'evil', 'kind', 'angry', 'lonely']
+GENRES = {'/m/07s9rl0': 'Drama', '/m/01z4y': 'Comedy', '/m/02l7c8': 'Romance Film', '/m/01jfsb': 'Thriller',
+          '/m/02kdv5l': 'Action', '/m/0lsxr': 'Crime Fiction', '/m/03npn': 'Horror', '/m/0219x_': 'Indie',
+          '/m/03k9fj': 'Adventure', '/m/0hqxf': 'Family Film', '/m/04t36': 'Musical', '/m/02hmvc': 'Short Film'}
+COUNTRIES = {'EU': ['FR', 'DE', 'GB', 'IT', 'ES', 'NO', 'PL', 'FI'], 'NA': ['US'], 'AS': ['IN']}
+COUNTRY_NAMES = ['United States of America', 'India', 'France', 'Germany', 'United Kingdom', 'Italy',
+                 'Spain', 'Norway', 'West Germany', 'Soviet Union', 'Hong Kong', 'South Korea', 'Czechoslovakia',
+                 'England', 'Japan', 'Kingdom of Great Britain', 'Weimar Republic', 'Republic of Macedonia']
+
+# ------------------ Synthetic CoreNLP documents ------------------ #
+
+def _token(idx, word, pos, ner='O'):
+    return (f'<token id="{idx}"><word>{word}</word><lemma>{word.lower()}</lemma>'
+            f'<CharacterOffsetBegin>0</CharacterOffsetBegin><CharacterOffsetEnd>0</CharacterOffsetEnd>'
+            f'<POS>{pos}</POS><NER>{ner}</NER></token>')
+
+
+def _dep(dep_type, governor, dependent):
+    return (f'<dep type="{dep_type}"><governor idx="{governor[0]}">{governor[1]}</governor>'
+            f'<dependent idx="{dependent[0]}">{dependent[1]}</dependent></dep>')
+
+
+def generate_sentence(rng, characters, sentence_id):
+    """
+    Generate a CoreNLP sentence of the form "<character> <verb> the <adjective> <noun|character> ."
+    with its tokens, parse and collapsed dependencies.
+
+    param rng: np.random.Generator
+    param characters: list of character full names (list of name parts)
+    param sentence_id: id of the sentence
+    return: xml of the sentence (string)
+    """
+    subject = characters[rng.integers(len(characters))]
+    # Mentions use either the full name or only one of its parts, as in real summaries
+    if rng.random() < 0.5:
+        subject = [subject[rng.integers(len(subject))]]
+    verb = VERBS[rng.integers(len(VERBS))]
+    adjective = ADJECTIVES[rng.integers(len(ADJECTIVES))]
+
+    tokens = [(word, 'NNP', 'PERSON') for word in subject]
+    verb_idx = len(tokens) + 1
+    tokens.append((verb, 'VBZ', 'O'))
+    tokens.append(('the', 'DT', 'O'))
+    adjective_idx = len(tokens) + 1
+    tokens.append((adjective, 'JJ', 'O'))
+    if rng.random() < 0.3:
+        obj = characters[rng.integers(len(characters))][-1:]
+        tokens.extend((word, 'NNP', 'PERSON') for word in obj)
+        obj_pos = 'NNP'
+    else:
+        obj = [NOUNS[rng.integers(len(NOUNS))]]
+        tokens.append((obj[0], 'NN', 'O'))
+        obj_pos = 'NN'
+    obj_idx = len(tokens)
+    tokens.append(('.', '.', 'O'))
+
+    subject_idx = len(subject)
+    deps = [_dep('nsubj', (verb_idx, verb), (subject_idx, subject[-1])),
+            _dep('dobj', (verb_idx, verb), (obj_idx, obj[-1])),
+            _dep('amod', (obj_idx, obj[-1]), (adjective_idx, adjective)),
+            _dep('det', (obj_idx, obj[-1]), (verb_idx + 1, 'the'))]
+    deps.extend(_dep('nn', (subject_idx, subject[-1]), (i + 1, word)) for i, word in enumerate(subject[:-1]))
+
+    parse = (f'(ROOT (S (NP {" ".join(f"(NNP {word})" for word in subject)}) (VP (VBZ {verb}) '
+             f'(NP (DT the) (JJ {adjective}) {" ".join(f"({obj_pos} {word})" for word in obj)})) (. .)))')
+    return (f'<sentence id="{sentence_id}"><tokens>'
+            + ''.join(_token(i + 1, *token) for i, token in enumerate(tokens))
+            + f'</tokens><parse>{parse}</parse>'
+            + '<basic-dependencies>' + ''.join(deps) + '</basic-dependencies>'
+            + '<collapsed-dependencies>' + ''.join(deps) + '</collapsed-dependencies>'
+            + '<collapsed-ccprocessed-dependencies>' + ''.join(deps) + '</collapsed-ccprocessed-dependencies>'
+            + '</sentence>')
+
+
+def generate_corenlp_xml(rng, n_sentences=20, n_characters=5):
+    """
+    Generate a CoreNLP xml document of a plot summary.
+
+    param rng: np.random.Generator
+    param n_sentences: number of sentences in the summary
+    param n_characters: number of characters in the summary
+    return: xml document (string)
+    """
+    characters = [[FIRST_NAMES[rng.integers(len(FIRST_NAMES))], LAST_NAMES[rng.integers(len(LAST_NAMES))]]
+                  for _ in range(n_characters)]
+    sentences = ''.join(generate_sentence(rng, characters, i + 1) for i in range(n_sentences))
+    return ('<?xml version="1.0" encoding="UTF-8"?><root><document><sentences>' + sentences
+            + '</sentences><coreference></coreference></document></root>')
+
+
+def write_corenlp_corpus(folder, n_movies, n_sentences=20, seed=0):
+    """
+    Write a corpus of synthetic CoreNLP xml documents in a folder, named like the real ones (<movie id>.xml).
+    The number of sentences and characters of each summary varies around the given size.
+
+    param folder: folder where the documents are written
+    param n_movies: number of documents
+    param n_sentences: average number of sentences per summary
+    param seed: random seed
+    return: list of the file names
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for movie_id in rng.choice(40_000_000, size=n_movies, replace=False):
+        filename = f'{movie_id}.xml'
+        xml = generate_corenlp_xml(rng, max(1, int(rng.poisson(n_sentences))), int(rng.integers(1, 10)))
+        with open(os.path.join(folder, filename), 'w') as f:
+            f.write(xml)
+        filenames.append(filename)
+    return filenames
+
+# ------------------ Synthetic movie tables ------------------ #
+
+def generate_movies(n_movies, seed=0):
+    """
+    Generate a movie table shaped like the files of data/matching.
+
+    param n_movies: number of movies
+    param seed: random seed
+    return: pd.DataFrame with the columns of balanced_geo.tsv plus main_char_gender and AverageRating
+    """
+    rng = np.random.default_rng(seed)
+    continents = rng.choice(list(COUNTRIES), size=n_movies, p=[0.4, 0.4, 0.2])
+    genre_ids = [str(genre_id) for genre_id in rng.choice(list(GENRES), size=n_movies)]
+    cast_sizes = rng.integers(1, 20, size=n_movies)
+    years = rng.integers(1925, 2013, size=n_movies).astype(float)
+    bins = (years.astype(int) - 1925) // 5 * 5 + 1925
+
+    return pd.DataFrame({
+        'WikiMovieID': rng.choice(40_000_000, size=n_movies, replace=False),
+        'MovieName': [f'Movie {i}' for i in range(n_movies)],
+        'ReleaseYear': years,
+        'MovieGenre': [str({genre_id: GENRES[genre_id]}) for genre_id in genre_ids],
+        'Continent': continents,
+        'Countries': [COUNTRIES[continent][rng.integers(len(COUNTRIES[continent]))] for continent in continents],
+        'ReleaseYearBin': [f'{start}-{start + 4}' for start in bins],
+        'PercentageofFemale': rng.binomial(cast_sizes, 0.3) / cast_sizes * 100,
+        'main_char_gender': rng.choice(['F', 'M'], size=n_movies, p=[0.3, 0.7]),
+        'AverageRating': np.round(rng.normal(6.2, 1.0, size=n_movies).clip(1, 10), 1),
+    })
+
+
+def generate_clusters(n_characters, seed=0, n_clusters=5):
+    """
+    Generate a character table shaped like the input of create_wordcloud.
+
+    param n_characters: number of characters
+    param seed: random seed
+    param n_clusters: number of clusters
+    return: pd.DataFrame with the columns cluster, Agent verbs, Patient verbs and Attributes
+    """
+    rng = np.random.default_rng(seed)
+
+    def words(vocabulary):
+        return [list(rng.choice(vocabulary, size=rng.integers(0, 6))) for _ in range(n_characters)]
+
+    return pd.DataFrame({'cluster': rng.integers(n_clusters, size=n_characters),
+                         'Agent verbs': words(VERBS), 'Patient verbs': words(VERBS),
+                         'Attributes': words(NOUNS + ADJECTIVES)})
+
+# ------------------ Measurements ------------------ #
+
+def measure(func, repeat=3, setup=None):
+    """
+    Measure the wall time and the peak memory allocated by a function. The timed runs are done without
+    tracemalloc, whose overhead would dominate the times, and the peak memory is measured in one more run.
+
+    param func: function to measure, called without argument
+    param repeat: number of timed runs, the fastest is kept
+    param setup: function called before each run, not measured
+    return: dictionary with the time (s) and the peak memory (MB)
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    # Tracing may already be running (e.g. instrumentation.enable(memory=True)), only stop it if started here
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - memory_start
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return {'time': min(times), 'peak_mb': peak / 2**20}
+
+
+def benchmarks(scale, folder, seed=0):
+    """
+    Describe the benchmarks at a given scale. The modules of the project are imported here so that the
+    generators can be used without their dependencies.
+
+    param scale: size factor of the synthetic data
+    param folder: folder for the synthetic CoreNLP corpus
+    param seed: random seed
+    return: dictionary mapping the name of each benchmark to (function, setup)
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import functions
+    import helpers_corenlp
+
+    filenames = write_corenlp_corpus(folder, n_movies=int(20 * scale), seed=seed)
+    movies = generate_movies(int(2000 * scale), seed=seed)
+    # create_pairs is quadratic, keep its input small
+    pairs_movies = movies.head(int(200 * scale))
+    eu, us = pairs_movies[pairs_movies['Continent'] == 'EU'], pairs_movies[pairs_movies['Countries'] == 'US']
+    rng = np.random.default_rng(seed)
+    characters = [' '.join(rng.choice(FIRST_NAMES + LAST_NAMES, size=rng.integers(1, 4)))
+                  for _ in range(int(200 * scale))]
+    country_names = list(rng.choice(COUNTRY_NAMES, size=int(1000 * scale)))
+    clusters = generate_clusters(int(500 * scale), seed=seed)
+
+    def get_list_movies():
+        for filename in filenames:
+            helpers_corenlp.get_list_movie(filename, folder)
+
+    def get_full_names():
+        for character in characters:
+            helpers_corenlp.get_full_name(character, characters)
+
+    def wordcloud():
+        functions.create_wordcloud(0, clusters, 'viridis')
+        plt.close('all')
+
+    def pairs():
+        # create_pairs prints a line per row, which would be timed with the matching
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            functions.create_pairs(['ReleaseYearBin', 'MovieGenre'], eu, us)
+
+    def corrected_wordcloud():
+        functions.create_corrected_wordcloud(0, clusters, VERBS[:3], VERBS[:3], NOUNS[:3], 'viridis')
+        plt.close('all')
+
+    return {
+        'get_list_movie': (get_list_movies, None),
+        'get_full_name': (get_full_names, None),
+        'create_pairs': (pairs, None),
+        # The lru_cache of findCountry is cleared so that every run does the fuzzy searches
+        'findCountry': (lambda: functions.bulkFindCountries(country_names), functions.findCountry.cache_clear),
+        'create_wordcloud': (wordcloud, None),
+        'create_corrected_wordcloud': (corrected_wordcloud, None),
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare benchmark results to a baseline.
+
+    param results: dictionary mapping the name of each benchmark to its measurements
+    param baseline: dictionary with the same structure
+    param tolerance: relative slowdown (or memory increase) above which a benchmark is a regression
+    return: list of the names of the benchmarks that regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f'{name:28s} no baseline')
+            continue
+        ratios = {metric: result[metric] / baseline[name][metric] if baseline[name][metric] else 1.0
+                  for metric in ['time', 'peak_mb']}
+        regressed = any(ratio > 1 + tolerance for ratio in ratios.values())
+        print(f'{name:28s} time x{ratios["time"]:.2f}  memory x{ratios["peak_mb"]:.2f}'
+              + ('  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the project functions on synthetic data.')
+    parser.add_argument('--scale', type=float, default=1.0, help='size factor of the synthetic data')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path of the baseline json file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown considered a regression')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        results = dict()
+        for name, (func, setup) in benchmarks(args.scale, folder, args.seed).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(func, args.repeat, setup)
+            print(f'{name:28s} {results[name]["time"]:9.4f} s  {results[name]["peak_mb"]:9.2f} MB')
+
+    key = f'scale={args.scale:g},seed={args.seed}'
+    baselines = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[key] = {**baselines.get(key, {}), **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        return 0
+
+    if key not in baselines:
+        print(f'No baseline for {key}, run with --save-baseline to create it')
+        return 0
+    return 1 if compare(results, baselines[key], args.tolerance) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
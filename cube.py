@@ -0,0 +1,311 @@
+import os
+import ast
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+# Dimensions of the cube, the ones missing from a table are left out
+DIMENSIONS = ['ReleaseYearBin', 'Continent', 'Countries', 'Genre', 'main_char_gender']
+# Measures of the cube with the range of their quantile sketch
+MEASURES = {'PercentageofFemale': (0, 100), 'AverageRating': (0, 10), 'FemaleMainChar': (0, 1)}
+# Number of bins of the histograms used as quantile sketches
+SKETCH_BINS = 200
+
+# ------------------ Chunk aggregation ------------------ #
+
+def prepare_chunk(chunk, genres=True):
+    """
+    Add the derived columns of a chunk of a matching table: Genre (one row per genre of the movie, from the
+    str-like dictionnaries of MovieGenre) and FemaleMainChar (1 if main_char_gender is 'F', 0 if 'M').
+
+    Parameters:
+    - chunk (pd.DataFrame): Rows of a matching table.
+    - genres (bool): Whether to add the Genre column. A movie with k genres then has k rows.
+
+    Returns:
+    - pd.DataFrame: The chunk with the derived columns.
+    """
+    chunk = chunk.copy()
+    if genres and 'MovieGenre' in chunk:
+        genres = chunk['MovieGenre'].apply(lambda genre: list(ast.literal_eval(genre).values())
+                                           if isinstance(genre, str) else [])
+        chunk['Genre'] = genres.apply(lambda genres: genres if genres else [np.nan])
+        chunk = chunk.explode('Genre')
+    if 'main_char_gender' in chunk:
+        chunk['FemaleMainChar'] = chunk['main_char_gender'].map({'F': 1.0, 'M': 0.0})
+    return chunk
+
+
+def aggregate_chunk(chunk, dimensions, measures, bins=SKETCH_BINS):
+    """
+    Compute the sufficient statistics of every cell of a chunk: for each measure, the number of values,
+    their sum, their sum of squares and their histogram (quantile sketch). These statistics can be merged
+    across chunks by summing them.
+
+    Parameters:
+    - chunk (pd.DataFrame): Rows of a matching table.
+    - dimensions (list): Columns defining the cells.
+    - measures (dict): Dictionary mapping each measure to the (min, max) range of its histogram.
+    - bins (int): Number of bins of the histograms.
+
+    Returns:
+    - pd.DataFrame: One row per cell, indexed by the dimensions, with the columns <measure>_count,
+                    <measure>_sum, <measure>_sumsq and <measure>_h<i> for each bin i. Without dimensions,
+                    a single row indexed by 'all'.
+    """
+    chunk = prepare_chunk(chunk, genres='Genre' in dimensions)
+    keys = [chunk[dimension].astype(object).to_numpy() for dimension in dimensions]
+    if keys:
+        groups = pd.Series(0, index=chunk.index).groupby(keys, dropna=False, sort=False)
+        cell = groups.ngroup().to_numpy()
+        n_cells = groups.ngroups
+    else:
+        cell = np.zeros(len(chunk), dtype=np.int64)
+        n_cells = 1
+
+    # Statistics are accumulated per cell with bincount, so memory grows with rows + cells, not rows * bins
+    parts = []
+    for measure, (low, high) in measures.items():
+        values = chunk[measure].to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        bin_idx = np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+        hist = np.bincount(cell[present] * bins + bin_idx[present], minlength=n_cells * bins)
+        count = np.bincount(cell, weights=present, minlength=n_cells).astype(np.int64)
+        parts.append(pd.DataFrame({f'{measure}_count': count,
+                                   f'{measure}_sum': np.bincount(cell, weights=values, minlength=n_cells),
+                                   f'{measure}_sumsq': np.bincount(cell, weights=values ** 2, minlength=n_cells)}))
+        parts.append(pd.DataFrame(hist.reshape(n_cells, bins), columns=[f'{measure}_h{i}' for i in range(bins)]))
+
+    # Key values of each cell, taken from its first row
+    first_rows = np.unique(cell, return_index=True)[1]
+    if not dimensions:
+        index = pd.Index(['all'])
+    elif len(dimensions) == 1:
+        index = pd.Index(keys[0][first_rows], name=dimensions[0])
+    else:
+        index = pd.MultiIndex.from_arrays([key[first_rows] for key in keys], names=dimensions)
+    return pd.concat(parts, axis=1).set_index(index)
+
+
+def aggregate_chunk_movies(chunk, dimensions, measures, bins=SKETCH_BINS):
+    """
+    Compute the statistics of a chunk both per cell of the dimensions and, if Genre is one of them, per cell
+    of the other dimensions with one row per movie (see aggregate_chunk).
+
+    Returns:
+    - tuple: The statistics per cell and the statistics per movie cell (None without Genre).
+    """
+    cells = aggregate_chunk(chunk, dimensions, measures, bins)
+    if 'Genre' not in dimensions:
+        return cells, None
+    movie_dimensions = [dimension for dimension in dimensions if dimension != 'Genre']
+    return cells, aggregate_chunk(chunk, movie_dimensions, measures, bins)
+
+
+def merge_cells(cells, dimensions):
+    """
+    Merge the statistics of several chunks by summing the statistics of the same cells.
+
+    Parameters:
+    - cells (list): Statistics of each chunk, as returned by aggregate_chunk.
+    - dimensions (list): Dimensions of the cells.
+
+    Returns:
+    - pd.DataFrame: The merged statistics.
+    """
+    return pd.concat(cells).groupby(level=dimensions or 0, dropna=False).sum()
+
+# ------------------ Cube ------------------ #
+
+class Cube:
+    """
+    Sufficient statistics of the measures for every combination of the dimensions. Any roll-up or slice is
+    answered from these statistics without going back to the table.
+
+    A movie with several genres is in several Genre cells, so the statistics without Genre are also kept
+    with one row per movie (movie_cells), to answer the roll-ups and slices that do not involve Genre.
+
+    Parameters:
+    - cells (pd.DataFrame): Statistics of each cell, as returned by aggregate_chunk.
+    - dimensions (list): Dimensions of the cube.
+    - measures (dict): Dictionary mapping each measure to the range of its histogram.
+    - bins (int): Number of bins of the histograms.
+    - movie_cells (pd.DataFrame): Statistics of each cell of the dimensions other than Genre, with one row
+                                  per movie (None if Genre is not a dimension).
+    """
+
+    def __init__(self, cells, dimensions, measures, bins=SKETCH_BINS, movie_cells=None):
+        self.cells = cells
+        self.dimensions = list(dimensions)
+        self.measures = dict(measures)
+        self.bins = bins
+        self.movie_cells = movie_cells
+
+    @classmethod
+    def build(cls, path, chunksize=100000, processes=None, dimensions=DIMENSIONS, measures=MEASURES,
+              bins=SKETCH_BINS):
+        """
+        Build the cube of a tsv file (e.g. data/matching/balanced_geo.tsv) by streaming it in chunks.
+        The chunks are aggregated in parallel and their statistics are merged.
+
+        Parameters:
+        - path (str): Path of the tsv file.
+        - chunksize (int): Number of rows read at a time.
+        - processes (int): Number of processes aggregating the chunks (number of CPUs if None, 1 to stay
+                           in the current process).
+        - dimensions (list): Dimensions of the cube, the ones missing from the file are left out.
+        - measures (dict): Measures of the cube with the range of their histogram, the ones missing from
+                           the file are left out.
+        - bins (int): Number of bins of the histograms.
+
+        Returns:
+        - Cube: The cube.
+        """
+        # 'NA' is the continent code of North America (and the country code of Namibia), not a missing value
+        read_kwargs = {'sep': '\t', 'keep_default_na': False, 'na_values': ['']}
+        header = pd.read_csv(path, nrows=0, **read_kwargs).columns
+        derived = {'Genre': 'MovieGenre', 'FemaleMainChar': 'main_char_gender'}
+        dimensions = [dimension for dimension in dimensions if derived.get(dimension, dimension) in header]
+        measures = {measure: limits for measure, limits in measures.items()
+                    if derived.get(measure, measure) in header}
+        chunks = pd.read_csv(path, chunksize=chunksize, **read_kwargs)
+        movie_dimensions = [dimension for dimension in dimensions if dimension != 'Genre']
+
+        cells = None
+        movie_cells = None
+
+        def merge(partial):
+            nonlocal cells, movie_cells
+            partial_cells, partial_movie_cells = partial
+            if cells is None:
+                cells, movie_cells = partial_cells, partial_movie_cells
+                return
+            cells = merge_cells([cells, partial_cells], dimensions)
+            if movie_cells is not None:
+                movie_cells = merge_cells([movie_cells, partial_movie_cells], movie_dimensions)
+
+        if processes == 1:
+            for chunk in chunks:
+                merge(aggregate_chunk_movies(chunk, dimensions, measures, bins))
+        else:
+            with ProcessPoolExecutor(processes) as executor:
+                # Only a few chunks are in flight at a time so that the file is never fully in memory
+                max_pending = 2 * (processes or os.cpu_count())
+                pending = []
+                for chunk in chunks:
+                    pending.append(executor.submit(aggregate_chunk_movies, chunk, dimensions, measures, bins))
+                    if len(pending) >= max_pending:
+                        merge(pending.pop(0).result())
+                for future in pending:
+                    merge(future.result())
+
+        if cells is None:
+            raise ValueError(f'No rows in {path}')
+        return cls(cells, dimensions, measures, bins, movie_cells)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another cube with the same dimensions and measures (e.g. built from new rows).
+
+        Parameters:
+        - other (Cube): The other cube.
+
+        Returns:
+        - Cube: The merged cube.
+        """
+        cells = merge_cells([self.cells, other.cells], self.dimensions)
+        movie_cells = None
+        if self.movie_cells is not None:
+            movie_dimensions = [dimension for dimension in self.dimensions if dimension != 'Genre']
+            movie_cells = merge_cells([self.movie_cells, other.movie_cells], movie_dimensions)
+        return Cube(cells, self.dimensions, self.measures, self.bins, movie_cells)
+
+    def save(self, path):
+        """
+        Save the cube to a pickle file.
+
+        Parameters:
+        - path (str): Path of the pickle file.
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """
+        Load a cube from a pickle file.
+
+        Parameters:
+        - path (str): Path of the pickle file.
+
+        Returns:
+        - Cube: The cube.
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _quantile(self, hists, measure, q):
+        """
+        Approximate a quantile of each row of histograms, interpolating linearly inside the bins.
+        """
+        low, high = self.measures[measure]
+        cumulative = np.cumsum(hists, axis=1)
+        total = cumulative[:, -1]
+        target = q * total
+        bin_idx = np.minimum((cumulative < target[:, None]).sum(axis=1), self.bins - 1)
+        rows = np.arange(len(hists))
+        before = np.where(bin_idx > 0, cumulative[rows, bin_idx - 1], 0)
+        in_bin = hists[rows, bin_idx]
+        fraction = np.divide(target - before, in_bin, out=np.zeros(len(hists)), where=in_bin > 0)
+        width = (high - low) / self.bins
+        return np.where(total > 0, low + (bin_idx + fraction) * width, np.nan)
+
+    def rollup(self, by=(), where=None, quantiles=(0.25, 0.5, 0.75)):
+        """
+        Aggregate the cube along some dimensions, after an optional slice. When Genre is grouped by or
+        sliced, a movie is counted once in each of its genres. Otherwise, each movie is counted once.
+
+        Parameters:
+        - by (list): Dimensions to group by (the other ones are rolled up). An empty list gives one row
+                     with the statistics of the whole table.
+        - where (dict): Slice of the cube, mapping dimensions to a value or a list of accepted values.
+        - quantiles (list): Quantiles to approximate from the histograms.
+
+        Returns:
+        - pd.DataFrame: For each group and each measure, the count, mean, standard deviation and quantiles
+                        (columns <measure>_count, <measure>_mean, <measure>_std, <measure>_q<quantile>).
+        """
+        by = list(by)
+        if self.movie_cells is not None and 'Genre' not in by and 'Genre' not in (where or {}):
+            cells = self.movie_cells
+        else:
+            cells = self.cells
+        for dimension, values in (where or {}).items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            cells = cells[cells.index.get_level_values(dimension).isin(values)]
+
+        if by:
+            grouped = cells.groupby(level=by, dropna=False).sum()
+        else:
+            grouped = cells.sum().to_frame('all').T
+
+        result = pd.DataFrame(index=grouped.index)
+        for measure in self.measures:
+            count = grouped[f'{measure}_count'].to_numpy(dtype=float)
+            total = grouped[f'{measure}_sum'].to_numpy(dtype=float)
+            sumsq = grouped[f'{measure}_sumsq'].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+                variance = (sumsq - count * mean ** 2) / (count - 1)
+            result[f'{measure}_count'] = count.astype(np.int64)
+            result[f'{measure}_mean'] = mean
+            result[f'{measure}_std'] = np.sqrt(np.clip(variance, 0, None))
+
+            hists = grouped[[f'{measure}_h{i}' for i in range(self.bins)]].to_numpy(dtype=float)
+            for q in quantiles:
+                result[f'{measure}_q{q:g}'] = self._quantile(hists, measure, q)
+        return result
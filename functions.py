@@ -12,6 +12,8 @@ import spacy
 nlp = spacy.load("en_core_web_lg")
 
 
+import ast
+import pickle
 from functools import lru_cache
 
 
@@ -104,6 +106,131 @@ def percent_missing_strdict(data):
     percent_missing=(sum(missing_values)/N)*100
     return(percent_missing)
 
+# String representations of empty values (e.g. a movie without genre in the CMU metadata is '{}')
+EMPTY_STRINGS = ['', '{}', '[]']
+
+def _merge_kinds(kinds):
+    '''
+    Merge the kinds of values inferred on several chunks of a column into a single kind.
+    '''
+    kinds = set(kinds) - {'empty'}
+    if not kinds:
+        return 'empty'
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds <= {'integer', 'floating', 'mixed-integer-float'}:
+        return 'floating'
+    return 'mixed'
+
+def _column_kind(column):
+    '''
+    Infer the kind of values of a column chunk: dict-string and list-string for str-like dictionnaries
+    and lists, dict and list for python containers, else the kind given by pandas (integer, floating, string...).
+    '''
+    kind = pd.api.types.infer_dtype(column, skipna=True)
+    if kind == 'string':
+        values = column.dropna()
+        if len(values) > 0 and values.str.startswith('{').all():
+            return 'dict-string'
+        if len(values) > 0 and values.str.startswith('[').all():
+            return 'list-string'
+    elif kind == 'mixed':
+        values = column.dropna()
+        if values.map(type).isin([dict]).all():
+            return 'dict'
+        if values.map(type).isin([list, tuple, set]).all():
+            return 'list'
+    return kind
+
+def profile_table(data, chunksize=100000, max_cardinality=100000, **read_kwargs):
+    '''
+    Profile the missing values and the schema of every column of a table in a single pass, chunk by chunk,
+    so that files larger than memory can be profiled. Missing values are NaN/None, and empty values are
+    empty strings, empty containers and str-like empty dictionnaries or lists (see percent_missing_strdict).
+
+    Parameters:
+    - data (pd.DataFrame or str): The table, or the path of a tsv file.
+    - chunksize (int): Number of rows processed at a time.
+    - max_cardinality (int): Number of distinct values above which a column stops being tracked exactly.
+    - read_kwargs: Additional arguments of pd.read_csv when data is a path. By default, only empty fields are
+                   read as missing, so that codes like 'NA' (North America, Namibia) are counted as values.
+
+    Returns:
+    - pd.DataFrame: One row per column with the dtype and kind of values, the number of rows, of missing
+                    and of empty values, the percentage of missing or empty values, the number of distinct
+                    values and whether this number is exact (False if it is above max_cardinality).
+    '''
+    if isinstance(data, pd.DataFrame):
+        columns = data.columns
+        chunks = (data.iloc[start:start + chunksize] for start in range(0, len(data), chunksize))
+    else:
+        read_kwargs.setdefault('sep', '\t')
+        read_kwargs.setdefault('keep_default_na', False)
+        read_kwargs.setdefault('na_values', [''])
+        columns = pd.read_csv(data, nrows=0, **read_kwargs).columns
+        chunks = pd.read_csv(data, chunksize=chunksize, **read_kwargs)
+
+    # Seeded from the columns so that an empty table still gets one row per column
+    stats = {name: {'dtypes': set(), 'kinds': [], 'count': 0, 'missing': 0, 'empty': 0, 'values': set(),
+                    'exact': True} for name in columns}
+    if isinstance(data, pd.DataFrame):
+        for name in columns:
+            stats[name]['dtypes'].add(str(data[name].dtype))
+
+    for chunk in chunks:
+        for name, column in chunk.items():
+            col_stats = stats[name]
+            missing = column.isna()
+            col_stats['dtypes'].add(str(column.dtype))
+            col_stats['kinds'].append(_column_kind(column))
+            col_stats['count'] += len(column)
+            col_stats['missing'] += int(missing.sum())
+
+            if not pd.api.types.is_numeric_dtype(column.dtype):
+                # .str.len gives the length of strings and containers, and NaN for other values
+                empty = column.isin(EMPTY_STRINGS)
+                try:
+                    empty |= column.str.len() == 0
+                except AttributeError:
+                    pass
+                col_stats['empty'] += int((empty & ~missing).sum())
+
+            if col_stats['exact']:
+                values = column[~missing]
+                try:
+                    col_stats['values'].update(values.unique())
+                except TypeError:
+                    # Unhashable values (lists, dicts) are compared through their representation
+                    col_stats['values'].update(values.astype(str).unique())
+                if len(col_stats['values']) > max_cardinality:
+                    # Keep the lower bound and free the memory
+                    col_stats['exact'] = False
+                    col_stats['cardinality'] = len(col_stats['values'])
+                    col_stats['values'] = set()
+
+    rows = []
+    for name, col_stats in stats.items():
+        dtypes = col_stats['dtypes']
+        if len(dtypes) == 1:
+            dtype = dtypes.pop()
+        elif dtypes <= {'int64', 'float64'}:
+            # A chunk with missing values is read as float
+            dtype = 'float64'
+        else:
+            dtype = 'object'
+        rows.append({'column': name,
+                     'dtype': dtype,
+                     'kind': _merge_kinds(col_stats['kinds']),
+                     'count': col_stats['count'],
+                     'missing': col_stats['missing'],
+                     'empty': col_stats['empty'],
+                     'percent_missing': (col_stats['missing'] + col_stats['empty']) / col_stats['count'] * 100
+                                        if col_stats['count'] else 0.0,
+                     'cardinality': len(col_stats['values']) if col_stats['exact'] else col_stats['cardinality'],
+                     'cardinality_exact': col_stats['exact']})
+    return pd.DataFrame(rows, columns=['column', 'dtype', 'kind', 'count', 'missing', 'empty', 'percent_missing',
+                                       'cardinality', 'cardinality_exact']).set_index('column')
+
 def exact_match(columns, row1, row2):
     """
     Check if two rows are an exact match on specified columns.
@@ -163,6 +290,44 @@ def find_main_char(cast):
 
     return main_char, main_actor, main_gender, main_cast
 
+def flatten_casts(casts):
+    """
+    Flatten a Series of cast lists into a columnar DataFrame with one row per cast member.
+
+    Parameters:
+    - casts (pd.Series): Series of lists of dictionaries representing the casts (or their string representation).
+                         Missing values are treated as empty casts.
+
+    Returns:
+    - pd.DataFrame: DataFrame with the columns movie (position of the movie in casts), cast_id, character, name and gender.
+    """
+    casts = [ast.literal_eval(cast) if isinstance(cast, str) else cast for cast in casts]
+    casts = [cast if isinstance(cast, list) else [] for cast in casts]
+    lengths = np.fromiter((len(cast) for cast in casts), dtype=np.int64, count=len(casts))
+
+    flat = pd.DataFrame.from_records([el for cast in casts for el in cast],
+                                     columns=['cast_id', 'character', 'name', 'gender'])
+    flat.insert(0, 'movie', np.repeat(np.arange(len(casts)), lengths))
+    return flat
+
+def find_main_chars(casts):
+    """
+    Find the main character of every movie based on the minimum cast_id, in a single pass over all the casts.
+    Batched equivalent of applying find_main_char to each cast.
+
+    Parameters:
+    - casts (pd.Series): Series of lists of dictionaries representing the casts (or their string representation).
+
+    Returns:
+    - pd.DataFrame: DataFrame with the same index as casts and the columns character, name, gender and cast_id
+                    of the main character. The values are missing for the movies with an empty cast.
+    """
+    flat = flatten_casts(casts)
+    main_chars = flat.loc[flat.groupby('movie', sort=False)['cast_id'].idxmin()].set_index('movie')
+    main_chars = main_chars.reindex(np.arange(len(casts)))[['character', 'name', 'gender', 'cast_id']]
+    main_chars.index = casts.index
+    return main_chars
+
 def create_pairs (columns, df1, df2):
     """
     Create maximal matching pairs of rows from df1 and df2 based on the exact_match_columns.
@@ -192,6 +357,134 @@ def create_pairs (columns, df1, df2):
     # Generate and return the maximum weight matching on the generated graph
     return nx.maximal_matching(G)
 
+def group_by_match_key(columns, df):
+    """
+    Group the indexes of a DataFrame by their values on the exact match columns.
+    Rows with a missing value are left out since they can never be an exact match.
+
+    Parameters:
+    - columns (list): List of column names to consider for the match.
+    - df (pd.DataFrame): Input DataFrame.
+
+    Returns:
+    - dict: Dictionary mapping each key (tuple of values) to the list of indexes of the rows having it.
+    """
+    # The keys are built as tuples, even for a single column, so that a saved state does not depend on how
+    # the version of pandas labels the groups
+    df = df[list(columns)].dropna()
+    groups = dict()
+    for idx, *key in df.itertuples(name=None):
+        groups.setdefault(tuple(key), []).append(idx)
+    return groups
+
+def create_matching_state(columns, df1, df2, pairs=None):
+    """
+    Create a persistent matching state between df1 and df2: the current pairs, plus the unmatched rows of
+    each side indexed by their exact match key. If no pairs are given, the rows of each block are paired
+    in order, which is a maximal matching.
+
+    Parameters:
+    - columns (list): List of column names to consider for the match.
+    - df1 (pd.DataFrame): First group of rows.
+    - df2 (pd.DataFrame): Second group of rows.
+    - pairs (list or pd.DataFrame): Existing pairs of indexes in df1 and df2 (e.g. read from pair_eu_us_idx.tsv).
+                                    Pairs stored in any order are accepted, since create_pairs returns
+                                    unordered edges: each pair is oriented with the df1 index first.
+
+    Returns:
+    - dict: The matching state, with keys 'columns', 'pairs', 'unmatched1' and 'unmatched2'.
+
+    Raises:
+    - ValueError: If a pair has none of its indexes in df1.
+    """
+    if pairs is None:
+        pairs = []
+    elif isinstance(pairs, pd.DataFrame):
+        pairs = list(pairs.itertuples(index=False, name=None))
+
+    oriented = []
+    for u, v in pairs:
+        if u in df1.index:
+            oriented.append((u, v))
+        elif v in df1.index:
+            oriented.append((v, u))
+        else:
+            raise ValueError(f'None of the indexes of the pair {(u, v)} is in df1')
+    pairs = oriented
+    matched1 = {pair[0] for pair in pairs}
+    matched2 = {pair[1] for pair in pairs}
+
+    state = {'columns': list(columns), 'pairs': pairs,
+             'unmatched1': group_by_match_key(columns, df1[~df1.index.isin(matched1)]),
+             'unmatched2': group_by_match_key(columns, df2[~df2.index.isin(matched2)])}
+    return update_pairs(state)
+
+def update_pairs(state, new_df1=None, new_df2=None):
+    """
+    Add new rows to a matching state and match them against the unmatched rows of the same block only.
+    Existing pairs are kept as they are, so the matching stays maximal without being recomputed.
+
+    Parameters:
+    - state (dict): Matching state created by create_matching_state (modified in place).
+    - new_df1 (pd.DataFrame): New rows of the first group, with indexes not already in the state.
+    - new_df2 (pd.DataFrame): New rows of the second group, with indexes not already in the state.
+
+    Returns:
+    - dict: The updated matching state.
+    """
+    columns = state['columns']
+    for new_df, unmatched in [(new_df1, state['unmatched1']), (new_df2, state['unmatched2'])]:
+        if new_df is not None:
+            for key, idx in group_by_match_key(columns, new_df).items():
+                unmatched.setdefault(key, []).extend(idx)
+
+    # Only the blocks with unmatched rows on both sides can produce new pairs
+    for key in [key for key in state['unmatched1'] if key in state['unmatched2']]:
+        candidates1 = state['unmatched1'][key]
+        candidates2 = state['unmatched2'][key]
+        n = min(len(candidates1), len(candidates2))
+        state['pairs'].extend(zip(candidates1[:n], candidates2[:n]))
+        del candidates1[:n], candidates2[:n]
+        if not candidates1:
+            del state['unmatched1'][key]
+        if not candidates2:
+            del state['unmatched2'][key]
+    return state
+
+def save_matching_state(state, path):
+    """
+    Save a matching state to a pickle file.
+
+    Parameters:
+    - state (dict): The matching state.
+    - path (str): Path of the pickle file.
+    """
+    with open(path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_matching_state(path):
+    """
+    Load a matching state from a pickle file.
+
+    Parameters:
+    - path (str): Path of the pickle file.
+
+    Returns:
+    - dict: The matching state.
+    """
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def write_pairs(state, path):
+    """
+    Write the pairs of a matching state in the format of the pair index files (e.g. pair_eu_us_idx.tsv).
+
+    Parameters:
+    - state (dict): The matching state.
+    - path (str): Path of the tsv file.
+    """
+    pd.DataFrame(state['pairs'], columns=[0, 1]).to_csv(path, sep='\t', index=False)
+
 def create_bins_of_5_years(df):
    
     # Create bins for every 5 years starting from the minimum release year to the maximum release year
@@ -207,7 +500,7 @@ def create_bins_of_5_years(df):
     return df
 
 
-def add_p_value_annotation(fig, array_columns, subplot=None, _format=dict(interline=0.07, text_height=1.07, color='black')):
+def add_p_value_annotation(fig, array_columns, subplot=None, _format=dict(interline=0.07, text_height=1.07, color='black'), samples=None):
     ''' Adds notations giving the p-value between two box plot data (t-test two-sided comparison)
     
     Parameters:
@@ -221,6 +514,9 @@ def add_p_value_annotation(fig, array_columns, subplot=None, _format=dict(interl
         specifies if the figures has subplots and what subplot to add the notation to
     _format: dict
         format characteristics for the lines
+    samples: None or list
+        data points of each box, needed when the boxes are drawn from precomputed
+        statistics (see plot_exports.box_plot) and the figure holds no data points
 
     Returns:
     -------
@@ -263,9 +559,13 @@ def add_p_value_annotation(fig, array_columns, subplot=None, _format=dict(interl
         #print('1:', fig_dict['data'][data_pair[1]]['name'], fig_dict['data'][data_pair[1]]['xaxis'])
 
         # Get the p-value
+        if samples is not None:
+            data_y = [samples[column_pair[0]], samples[column_pair[1]]]
+        else:
+            data_y = [fig_dict['data'][data_pair[0]]['y'], fig_dict['data'][data_pair[1]]['y']]
         pvalue = stats.ttest_ind(
-            fig_dict['data'][data_pair[0]]['y'],
-            fig_dict['data'][data_pair[1]]['y'],
+            data_y[0],
+            data_y[1],
             equal_var=False,
         )[1]
         if pvalue >= 0.05:
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import functools
+import tracemalloc
+from multiprocessing import Pool
+
+import pandas as pd
+
+import helpers_corenlp
+
+
+# Stage of the extraction pipeline measured for each function of helpers_corenlp.
+# The time of a stage is its self time: the time spent in nested stages is not counted twice.
+STAGES = {
+    'get_tree': 'xml_parsing',
+    'get_characters': 'character_detection',
+    'get_full_names_list': 'name_resolution',
+    'get_full_names_dict': 'name_resolution',
+    'get_verbs_noun_adjectives': 'pos_extraction',
+    'get_dependencies': 'dependency_extraction',
+    'filter_dependencies': 'dependency_filtering',
+    'get_verbs_attributes': 'verbs_attributes',
+    'get_mentions': 'mentions',
+    'sort_by_mention': 'mentions',
+    'get_main_character': 'mentions',
+    'get_list_movie': 'list_building',
+    'get_df_movie': 'dataframe',
+}
+# Functions starting the record of a movie when they are not called from another instrumented function
+ROOTS = ['get_df_movie', 'get_list_movie']
+
+_originals = dict()
+_state = {'movie': None, 'records': [], 'memory': False, 'started_tracing': False}
+
+# ------------------ Enabling and disabling ------------------ #
+
+def enable(memory=False):
+    """
+    Enable the instrumentation by replacing the functions of helpers_corenlp with timed wrappers.
+    When it is disabled, the original functions are used, so it costs nothing.
+
+    param memory: whether to record the peak allocation of each movie with tracemalloc (slower)
+    """
+    if _originals:
+        return
+    _state['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state['started_tracing'] = True
+    for name, stage in STAGES.items():
+        _originals[name] = getattr(helpers_corenlp, name)
+        setattr(helpers_corenlp, name, _instrument(_originals[name], name, stage))
+
+
+def disable():
+    """
+    Disable the instrumentation and restore the original functions of helpers_corenlp.
+    The records are kept until reset is called.
+    """
+    for name, func in _originals.items():
+        setattr(helpers_corenlp, name, func)
+    _originals.clear()
+    # Only stop tracemalloc if it was started by enable
+    if _state['started_tracing'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['started_tracing'] = False
+    _state['memory'] = False
+
+
+def is_enabled():
+    """
+    return: whether the instrumentation is enabled
+    """
+    return bool(_originals)
+
+
+def get_records():
+    """
+    Get the records of the movies processed since the last reset.
+
+    return: list of dictionaries with, for each movie, the movie id, the process id, the total time (s),
+            the self time (s) and number of calls of each stage, the number of xml elements and tokens,
+            the peak allocation of the movie above the memory already in use when it started (bytes, if
+            enabled with memory=True) and the timed events
+    """
+    return _state['records']
+
+
+def reset():
+    """
+    Delete the records.
+    """
+    _state['records'] = []
+
+# ------------------ Wrappers ------------------ #
+
+def _new_record(movie_id):
+    return {'movie_id': movie_id, 'pid': os.getpid(), 'total': 0.0, 'stages': dict(),
+            'elements': None, 'tokens': None, 'peak_bytes': None, 'events': [], '_children': [0.0]}
+
+
+def _instrument(func, name, stage):
+    """
+    Wrap a function of helpers_corenlp to record its self time in the current movie record.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = _state['movie']
+        is_root = record is None
+        if is_root:
+            if name not in ROOTS:
+                return func(*args, **kwargs)
+            record = _new_record(helpers_corenlp.get_movie_id(args[0] if args else kwargs['movie_xml']))
+            _state['movie'] = record
+            if _state['memory']:
+                tracemalloc.reset_peak()
+                memory_start = tracemalloc.get_traced_memory()[0]
+
+        record['_children'].append(0.0)
+        wall_start = time.time()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = record['_children'].pop()
+            record['_children'][-1] += elapsed
+
+            stats = record['stages'].setdefault(stage, {'time': 0.0, 'calls': 0})
+            stats['time'] += elapsed - children
+            stats['calls'] += 1
+            record['events'].append((name, wall_start * 1e6, elapsed * 1e6))
+
+            if is_root:
+                record['total'] = elapsed
+                if _state['memory']:
+                    # Only count what was allocated while processing this movie
+                    record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - memory_start
+                del record['_children']
+                _state['records'].append(record)
+                _state['movie'] = None
+
+        # The xml is parsed several times per movie, count its size only once (outside of the timings)
+        if name == 'get_tree' and record['elements'] is None:
+            record['elements'] = sum(1 for _ in result.iter())
+            record['tokens'] = sum(1 for _ in result.iter('token'))
+        return result
+
+    return wrapper
+
+# ------------------ Corpus runs ------------------ #
+
+def _init_worker(memory):
+    enable(memory)
+
+
+def _profile_movie(movie_xml, data_path):
+    reset()
+    df = helpers_corenlp.get_df_movie(movie_xml, data_path)
+    return df, get_records()
+
+
+def profile_corpus(movie_xmls, data_path=helpers_corenlp.CORE_NLP_XML, processes=None, memory=False):
+    """
+    Run get_df_movie on a corpus with the instrumentation enabled, possibly in several processes,
+    and gather the records of all the processes.
+
+    param movie_xmls: list of xml file names
+    param data_path: path to the folder containing the xml files
+    param processes: number of processes (in the current process if None)
+    param memory: whether to record the peak allocation of each movie
+    return: dataframe of all the characters (as get_df_movie) and list of the records of all the movies
+    """
+    if processes is None:
+        was_enabled = is_enabled()
+        enable(memory)
+        try:
+            results = [_profile_movie(movie_xml, data_path) for movie_xml in movie_xmls]
+        finally:
+            if not was_enabled:
+                disable()
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(memory,)) as pool:
+            results = pool.starmap(_profile_movie, [(movie_xml, data_path) for movie_xml in movie_xmls])
+
+    dfs = [df for df, _ in results]
+    records = [record for _, movie_records in results for record in movie_records]
+    return (pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()), records
+
+# ------------------ Analysis and export ------------------ #
+
+def summary(records):
+    """
+    Aggregate the records per stage.
+
+    param records: list of movie records (from one or several processes)
+    return: dataframe with the total self time, number of calls, mean time per movie and share of the total
+            time of each stage, sorted by decreasing time
+    """
+    rows = [{'stage': stage, 'time': stats['time'], 'calls': stats['calls']}
+            for record in records for stage, stats in record['stages'].items()]
+    if not rows:
+        return pd.DataFrame(columns=['time', 'calls', 'time_per_movie', 'share'])
+    df = pd.DataFrame(rows).groupby('stage').sum()
+    df['time_per_movie'] = df['time'] / len(records)
+    df['share'] = df['time'] / df['time'].sum()
+    return df.sort_values('time', ascending=False)
+
+
+def slowest(records, n=10, stage=None):
+    """
+    Find the movies that dominate a run.
+
+    param records: list of movie records
+    param n: number of movies to return
+    param stage: stage to sort by (total time if None)
+    return: dataframe with the movie id, total time, stage time, number of xml elements and tokens and
+            peak allocation of the n slowest movies
+    """
+    df = pd.DataFrame([{'movie_id': record['movie_id'], 'total': record['total'],
+                        'stage_time': record['stages'].get(stage, {'time': 0.0})['time'] if stage else record['total'],
+                        'elements': record['elements'], 'tokens': record['tokens'],
+                        'peak_bytes': record['peak_bytes']} for record in records])
+    if df.empty:
+        return df
+    return df.sort_values('stage_time', ascending=False).head(n).reset_index(drop=True)
+
+
+def to_json(records, path):
+    """
+    Export the records and their summary to a json file.
+
+    param records: list of movie records
+    param path: path of the json file
+    """
+    with open(path, 'w') as f:
+        json.dump({'summary': summary(records).reset_index().to_dict(orient='records'),
+                   'movies': [{key: value for key, value in record.items() if key != 'events'}
+                              for record in records]}, f, indent=1)
+
+
+def to_chrome_trace(records, path):
+    """
+    Export the timed events of the records to a Chrome trace file (to open in chrome://tracing or Perfetto).
+
+    param records: list of movie records
+    param path: path of the json file
+    """
+    events = []
+    for record in records:
+        for name, start, duration in record['events']:
+            events.append({'name': name, 'cat': STAGES[name], 'ph': 'X', 'ts': start, 'dur': duration,
+                           'pid': record['pid'], 'tid': record['pid'], 'args': {'movie_id': record['movie_id']}})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,493 @@
+import os
+import ast
+import pickle
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+import pycountry_convert as pc
+
+import functions
+from functions import (convert_date, create_bins_of_5_years, bulkFindCountries, process_countries,
+                       find_main_chars, create_pairs)
+
+
+# DATA PATH
+current_directory = os.getcwd()
+MATCHING_PATH = os.path.join(current_directory, 'data', 'matching')
+CACHE_PATH = os.path.join(current_directory, 'data', 'cache')
+
+GEO_MATCH_COLUMNS = ['ReleaseYearBin', 'MovieGenre']
+MAIN_CHAR_MATCH_COLUMNS = ['Countries', 'MovieGenre', 'ReleaseYearBin']
+
+GEO_COLUMNS = ['WikiMovieID', 'MovieName', 'ReleaseYear', 'MovieGenre', 'Continent', 'Countries',
+               'ReleaseYearBin', 'PercentageofFemale']
+MAIN_CHAR_COLUMNS = ['WikiMovieID', 'MovieName', 'Countries', 'MovieGenre', 'main_char_gender',
+                     'AverageRating', 'ReleaseYearBin', 'ReleaseYear']
+
+# TMDB encodes the gender of the cast as 1 for female and 2 for male (0 is unknown)
+TMDB_GENDERS = {1: 'F', 2: 'M'}
+
+
+# ------------------ Pipeline runner ------------------ #
+
+class Stage:
+    """
+    A step of the pipeline.
+
+    Parameters:
+    - name (str): Unique name of the stage, used to refer to its output.
+    - func (callable): Module-level function computing the output of the stage. It is called with the
+                       outputs of the upstream stages (in the order of `inputs`) followed by `params`.
+    - inputs (list): Names of the upstream stages whose outputs are passed to `func`.
+    - params (dict): Keyword arguments passed to `func`.
+    - files (list): Paths of the files read by `func`, whose content is part of the cache key.
+    - version (str): Part of the cache key, to change by hand to invalidate the stage when code that is
+                     not hashed (e.g. another library) changes.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(), version=''):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.files = list(files)
+        self.version = version
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, inputs={self.inputs})'
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Compute the sha256 digest of the content of a file.
+
+    Parameters:
+    - path (str): Path of the file.
+    - chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+    - str: Hexadecimal digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_key(stage, input_keys):
+    """
+    Compute the cache key of a stage from its code, the source files of its module and of functions.py
+    (where the helpers and constants it uses live), its parameters and default arguments, its version, the content of the files it reads and
+    the keys of its upstream stages. Any change in one of them gives a new key.
+
+    Parameters:
+    - stage (Stage): The stage.
+    - input_keys (list): Cache keys of the upstream stages, in the order of `stage.inputs`.
+
+    Returns:
+    - str: Hexadecimal cache key.
+    """
+    digest = hashlib.sha256()
+    digest.update(stage.name.encode())
+    try:
+        digest.update(inspect.getsource(stage.func).encode())
+    except (OSError, TypeError):
+        digest.update(stage.func.__qualname__.encode())
+    # The helpers and constants used by the stage (e.g. match, GEO_COLUMNS) live in its own module and in
+    # functions.py, so both files are hashed
+    source_files = {inspect.getsourcefile(functions)}
+    try:
+        source_files.add(inspect.getsourcefile(stage.func))
+    except TypeError:
+        pass
+    for path in sorted(source_files):
+        digest.update(hash_file(path).encode())
+    digest.update(stage.version.encode())
+    digest.update(repr(sorted(stage.params.items())).encode())
+    # Default arguments (e.g. GEO_MATCH_COLUMNS) are hashed by value
+    try:
+        defaults = {name: parameter.default for name, parameter in inspect.signature(stage.func).parameters.items()
+                    if parameter.default is not inspect.Parameter.empty}
+    except (ValueError, TypeError):
+        defaults = dict()
+    digest.update(repr(sorted(defaults.items())).encode())
+    for path in stage.files:
+        digest.update(hash_file(path).encode())
+    for key in input_keys:
+        digest.update(key.encode())
+    return digest.hexdigest()
+
+
+def topological_order(stages):
+    """
+    Sort the stages so that every stage comes after the stages it depends on.
+
+    Parameters:
+    - stages (list): List of Stage.
+
+    Returns:
+    - list: The stages in topological order.
+
+    Raises:
+    - ValueError: If a stage depends on an unknown stage or if the dependencies contain a cycle.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    order = []
+    state = dict()  # name -> 'visiting' or 'done'
+
+    def visit(name):
+        if name not in by_name:
+            raise ValueError(f'Unknown stage: {name}')
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f'Cycle in the pipeline at stage: {name}')
+        state[name] = 'visiting'
+        for input_name in by_name[name].inputs:
+            visit(input_name)
+        state[name] = 'done'
+        order.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name)
+    return order
+
+
+def _run_stage(func, args, params, cache_file):
+    """
+    Run a stage and store its output in the cache. Executed in a worker process.
+    """
+    output = func(*args, **params)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return output
+
+
+def run_pipeline(stages, targets=None, cache_dir=CACHE_PATH, max_workers=None, force=()):
+    """
+    Run the stages needed to compute the targets. The output of each stage is cached on disk under a key
+    depending on its code, parameters, input files and upstream stages, so that only the stages that were
+    invalidated are run again. Independent stages are run in parallel in separate processes.
+
+    Parameters:
+    - stages (list): List of Stage describing the pipeline.
+    - targets (list): Names of the stages to compute. All the stages if None.
+    - cache_dir (str): Folder where the outputs of the stages are stored.
+    - max_workers (int): Maximum number of stages run at the same time (number of CPUs if None).
+    - force (list): Names of stages to run again even if their output is cached.
+
+    Returns:
+    - dict: Dictionary mapping the name of each computed stage to its output.
+
+    Raises:
+    - ValueError: If a target or a forced stage is not a stage of the pipeline.
+    """
+    order = topological_order(stages)
+    by_name = {stage.name: stage for stage in order}
+    for name in list(targets or []) + list(force):
+        if name not in by_name:
+            raise ValueError(f'Unknown stage: {name}')
+
+    # Only keep the targets and their upstream stages
+    needed = set()
+    todo = list(targets) if targets is not None else list(by_name)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(by_name[name].inputs)
+    order = [stage for stage in order if stage.name in needed]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = dict()
+    for stage in order:
+        keys[stage.name] = stage_key(stage, [keys[name] for name in stage.inputs])
+
+    def cache_file(stage):
+        return os.path.join(cache_dir, f'{stage.name}-{keys[stage.name][:16]}.pkl')
+
+    outputs = dict()
+    pending = []
+    for stage in order:
+        if stage.name not in force and os.path.exists(cache_file(stage)):
+            print(f'Stage {stage.name}: cached')
+            with open(cache_file(stage), 'rb') as f:
+                outputs[stage.name] = pickle.load(f)
+        else:
+            pending.append(stage)
+
+    running = dict()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Submit every stage whose inputs are available
+            for stage in [stage for stage in pending if all(name in outputs for name in stage.inputs)]:
+                print(f'Stage {stage.name}: running')
+                args = [outputs[name] for name in stage.inputs]
+                future = executor.submit(_run_stage, stage.func, args, stage.params, cache_file(stage))
+                running[future] = stage
+                pending.remove(stage)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                outputs[stage.name] = future.result()
+                print(f'Stage {stage.name}: done')
+
+    return outputs
+
+
+# ------------------ Stages of the matching datasets ------------------ #
+
+def load_tsv(path):
+    """
+    Load a tab separated file.
+
+    Parameters:
+    - path (str): Path of the file.
+
+    Returns:
+    - pd.DataFrame: The content of the file.
+    """
+    return pd.read_csv(path, sep='\t')
+
+
+def add_release_year(movies):
+    """
+    Add the ReleaseYear column computed from the ReleaseDate column, and drop the movies without date.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with a ReleaseDate column.
+
+    Returns:
+    - pd.DataFrame: A copy of the movies with the ReleaseYear column.
+    """
+    movies = movies.dropna(subset=['ReleaseDate']).copy()
+    movies['ReleaseYear'] = movies['ReleaseDate'].astype(str).apply(convert_date).dt.year.astype(float)
+    return movies
+
+
+def add_year_bins(movies):
+    """
+    Add the ReleaseYearBin column without modifying the input.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with a ReleaseYear column.
+
+    Returns:
+    - pd.DataFrame: A copy of the movies with the ReleaseYearBin column (as strings).
+    """
+    movies = create_bins_of_5_years(movies.copy())
+    movies['ReleaseYearBin'] = movies['ReleaseYearBin'].astype(str)
+    return movies
+
+
+def country_to_continent(country):
+    """
+    Find the continent code of an ISO alpha-2 country code.
+
+    Parameters:
+    - country (str): ISO alpha-2 country code.
+
+    Returns:
+    - str: Continent code (e.g. 'EU', 'NA', 'AS'), or None if the country has no continent.
+    """
+    try:
+        return pc.country_alpha2_to_continent_code(country)
+    except KeyError:
+        return None
+
+
+def resolve_countries(movies):
+    """
+    Replace the str-like dictionnaries of the Countries column by an ISO alpha-2 country code and add the
+    Continent column. Movies with no country found or with countries on different continents are removed,
+    and the first country is kept for the others.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with a Countries column.
+
+    Returns:
+    - pd.DataFrame: A copy of the movies with the resolved Countries and Continent columns.
+    """
+    movies = movies.copy()
+    names = movies['Countries'].apply(lambda countries: list(ast.literal_eval(countries).values()))
+    codes = names.apply(lambda countries: process_countries(bulkFindCountries(countries)))
+    continents = codes.apply(lambda countries: {country_to_continent(country) for country in countries}
+                             if countries else set())
+
+    keep = continents.apply(lambda continents: len(continents) == 1 and None not in continents)
+    movies = movies[keep]
+    movies['Countries'] = codes[keep].str[0]
+    movies['Continent'] = continents[keep].apply(lambda continents: next(iter(continents)))
+    return movies
+
+
+def add_main_char_gender(movies, credits):
+    """
+    Add the main_char_gender column from the TMDB cast of each movie. Movies whose main character has an
+    unknown gender are removed.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with a WikiMovieID column.
+    - credits (pd.DataFrame): TMDB credits with a WikiMovieID column and the cast as str-like list of dicts.
+
+    Returns:
+    - pd.DataFrame: The movies with the main_char_gender column.
+    """
+    main_chars = find_main_chars(credits.set_index('WikiMovieID')['cast'])
+    genders = main_chars['gender'].map(TMDB_GENDERS).dropna().rename('main_char_gender')
+    return movies.merge(genders, left_on='WikiMovieID', right_index=True, how='inner')
+
+
+def match(df1, df2, columns):
+    """
+    Match the rows of df1 and df2 with create_pairs.
+
+    Parameters:
+    - df1 (pd.DataFrame): First group of movies.
+    - df2 (pd.DataFrame): Second group of movies, with an index disjoint from the one of df1.
+    - columns (list): List of column names to consider for the match.
+
+    Returns:
+    - pd.DataFrame: Sorted pairs of indexes in df1 (column 0) and df2 (column 1).
+    """
+    pairs = create_pairs(columns, df1, df2)
+    # The matching returns unordered edges: put the df1 index first
+    pairs = [(u, v) if u in df1.index else (v, u) for u, v in pairs]
+    return pd.DataFrame(sorted(pairs), columns=[0, 1])
+
+
+def match_continents(movies, continent1, continent2, country2=None, columns=GEO_MATCH_COLUMNS):
+    """
+    Match the movies of two continents (or of a continent and a country).
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with the Continent and Countries columns.
+    - continent1 (str): Continent code of the first group.
+    - continent2 (str): Continent code of the second group.
+    - country2 (str): If given, only keep the movies of this country in the second group.
+    - columns (list): List of column names to consider for the match.
+
+    Returns:
+    - pd.DataFrame: Pairs of indexes in the first (column 0) and second (column 1) group.
+    """
+    df1 = movies[movies['Continent'] == continent1]
+    df2 = movies[movies['Continent'] == continent2]
+    if country2 is not None:
+        df2 = df2[df2['Countries'] == country2]
+    return match(df1, df2, columns)
+
+
+def match_main_char(movies, columns=MAIN_CHAR_MATCH_COLUMNS):
+    """
+    Match the movies with a female main character to the movies with a male main character.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with the main_char_gender column.
+    - columns (list): List of column names to consider for the match.
+
+    Returns:
+    - pd.DataFrame: Pairs of indexes of female (column 0) and male (column 1) main character movies.
+    """
+    return match(movies[movies['main_char_gender'] == 'F'], movies[movies['main_char_gender'] == 'M'], columns)
+
+
+def paired_rows(movies, pairs, columns=None):
+    """
+    Get the rows of the paired movies: first the rows of the first group, then the rows of the second group
+    in the same order.
+
+    Parameters:
+    - movies (pd.DataFrame): The movies.
+    - pairs (pd.DataFrame): Pairs of indexes of movies.
+    - columns (list): Columns to keep. All the columns if None.
+
+    Returns:
+    - pd.DataFrame: The paired movies.
+    """
+    rows = pd.concat([movies.loc[pairs[0]], movies.loc[pairs[1]]])
+    return rows if columns is None else rows[columns]
+
+
+def balance_geo(movies, pairs_eu_us, pairs_eu_in):
+    """
+    Build the dataset balanced across Europe, the USA and India: keep the European movies matched both with
+    an American and an Indian movie, along with their two matches.
+
+    Parameters:
+    - movies (pd.DataFrame): Movies with the columns of GEO_COLUMNS.
+    - pairs_eu_us (pd.DataFrame): Pairs of indexes of European and American movies.
+    - pairs_eu_in (pd.DataFrame): Pairs of indexes of European and Indian movies.
+
+    Returns:
+    - pd.DataFrame: The balanced movies.
+    """
+    pairs = pairs_eu_us.merge(pairs_eu_in, on=0, suffixes=('_us', '_in'))
+    idx = pd.concat([pairs[0], pairs['1_us'], pairs['1_in']])
+    return movies.loc[idx, GEO_COLUMNS]
+
+
+def matching_stages(movies_path, credits_path):
+    """
+    Describe the pipeline building the matching datasets.
+
+    Parameters:
+    - movies_path (str): Path of the tsv file of the preprocessed CMU movies, with the columns WikiMovieID,
+                         MovieName, ReleaseDate, MovieGenre, Countries, PercentageofFemale and AverageRating.
+    - credits_path (str): Path of the tsv file of the TMDB credits, with the columns WikiMovieID and cast.
+
+    Returns:
+    - list: List of Stage.
+    """
+    return [
+        Stage('movies', load_tsv, params={'path': movies_path}, files=[movies_path]),
+        Stage('credits', load_tsv, params={'path': credits_path}, files=[credits_path]),
+        Stage('release_year', add_release_year, inputs=['movies']),
+        Stage('year_bins', add_year_bins, inputs=['release_year']),
+        Stage('countries', resolve_countries, inputs=['year_bins']),
+        Stage('main_char', add_main_char_gender, inputs=['countries', 'credits']),
+        Stage('pair_eu_us_idx', match_continents, inputs=['countries'],
+              params={'continent1': 'EU', 'continent2': 'NA', 'country2': 'US'}),
+        Stage('pair_eu_in_idx', match_continents, inputs=['countries'],
+              params={'continent1': 'EU', 'continent2': 'AS', 'country2': 'IN'}),
+        Stage('pair_main_char_idx', match_main_char, inputs=['main_char']),
+        Stage('df_pair_eu_us', paired_rows, inputs=['countries', 'pair_eu_us_idx'],
+              params={'columns': GEO_COLUMNS}),
+        Stage('df_pair_eu_in', paired_rows, inputs=['countries', 'pair_eu_in_idx'],
+              params={'columns': GEO_COLUMNS}),
+        Stage('balanced_geo', balance_geo, inputs=['countries', 'pair_eu_us_idx', 'pair_eu_in_idx']),
+        Stage('balanced_main_char', paired_rows, inputs=['main_char', 'pair_main_char_idx'],
+              params={'columns': MAIN_CHAR_COLUMNS}),
+    ]
+
+
+def build_matching_datasets(movies_path, credits_path, output_path=MATCHING_PATH, cache_dir=CACHE_PATH,
+                            max_workers=None):
+    """
+    Build the matching datasets and write them in output_path: balanced_geo.tsv, balanced_main_char.tsv,
+    df_pair_eu_us.tsv, df_pair_eu_in.tsv and the pair index files.
+
+    Parameters:
+    - movies_path (str): Path of the tsv file of the preprocessed CMU movies (see matching_stages).
+    - credits_path (str): Path of the tsv file of the TMDB credits (see matching_stages).
+    - output_path (str): Folder where the datasets are written.
+    - cache_dir (str): Folder where the outputs of the stages are cached.
+    - max_workers (int): Maximum number of stages run at the same time.
+
+    Returns:
+    - dict: Dictionary mapping the name of each written dataset to its content.
+    """
+    outputs = ['balanced_geo', 'balanced_main_char', 'df_pair_eu_us', 'df_pair_eu_in',
+               'pair_eu_us_idx', 'pair_eu_in_idx', 'pair_main_char_idx']
+    results = run_pipeline(matching_stages(movies_path, credits_path), targets=outputs,
+                           cache_dir=cache_dir, max_workers=max_workers)
+
+    os.makedirs(output_path, exist_ok=True)
+    for name in outputs:
+        results[name].to_csv(os.path.join(output_path, name + '.tsv'), sep='\t', index=False)
+    return {name: results[name] for name in outputs}
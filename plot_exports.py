@@ -0,0 +1,202 @@
+import ast
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+# Shared reference to plotly.js instead of embedding the 3.5MB bundle in every html file.
+# A path to a local copy (e.g. 'plotly.min.js' next to the html files) can be given instead.
+PLOTLYJS = 'cdn'
+
+# ------------------ Server-side aggregation ------------------ #
+
+def box_stats(values, whis=1.5):
+    """
+    Compute the statistics drawn by a plotly box plot with Tukey whiskers.
+
+    Parameters:
+    - values (array-like): The data points (missing values are ignored).
+    - whis (float): Length of the whiskers in number of interquartile ranges.
+
+    Returns:
+    - dict: Dictionary with the q1, median, q3, lowerfence and upperfence of the box and the outliers (np.array).
+            The statistics are NaN and there are no outliers if there is no data point.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'q1': np.nan, 'median': np.nan, 'q3': np.nan, 'lowerfence': np.nan, 'upperfence': np.nan,
+                'outliers': np.array([], dtype=float)}
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+
+    # The whiskers end at the furthest data points within whis * IQR of the box
+    inside = values[(values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)]
+    lowerfence, upperfence = inside.min(), inside.max()
+    outliers = values[(values < lowerfence) | (values > upperfence)]
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence, 'upperfence': upperfence,
+            'outliers': outliers}
+
+
+def parse_genres(genres):
+    """
+    Flatten a column of movie genres into a single array of genre names.
+
+    Parameters:
+    - genres (array-like): Genres of each movie, as str-like dictionnaries (e.g. "{'/m/07s9rl0': 'Drama'}"),
+                           dictionnaries or lists of genre names.
+
+    Returns:
+    - np.array: Genre names, one entry per (movie, genre).
+    """
+    names = []
+    for genre in genres:
+        if isinstance(genre, str):
+            genre = ast.literal_eval(genre)
+        names.extend(genre.values() if isinstance(genre, dict) else genre)
+    return np.array(names, dtype=object)
+
+
+def genre_counts(genres, top=16):
+    """
+    Count the number of movies of each genre.
+
+    Parameters:
+    - genres (array-like): Genres of each movie (see parse_genres).
+    - top (int): Number of most frequent genres to keep. All the genres if None.
+
+    Returns:
+    - tuple: Genre names (np.array) and number of movies (np.array), by decreasing number of movies.
+    """
+    names, counts = np.unique(parse_genres(genres), return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:top]
+    return names[order], counts[order]
+
+
+def genre_gender_percentages(genres, genders, female='F', male='M'):
+    """
+    Compute the percentages of women and men among the characters of known gender of each genre.
+
+    Parameters:
+    - genres (array-like): Genre of each character (one genre name per entry).
+    - genders (array-like): Gender of each character.
+    - female (str): Value of genders for women.
+    - male (str): Value of genders for men. The characters with another gender (e.g. missing) are left out.
+
+    Returns:
+    - tuple: Genre names (np.array), percentages of men and percentages of women (np.array),
+             by decreasing percentage of men.
+    """
+    genres = np.asarray(genres, dtype=object)
+    genders = np.asarray(genders, dtype=object)
+    is_female = genders == female
+    known = is_female | (genders == male)
+    names, codes = np.unique(genres[known], return_inverse=True)
+    total = np.bincount(codes, minlength=len(names))
+    women = np.bincount(codes, weights=is_female[known], minlength=len(names))
+    percent_women = 100 * women / total
+    percent_men = 100 - percent_women
+    order = np.argsort(-percent_men, kind='stable')
+    return names[order], percent_men[order], percent_women[order]
+
+# ------------------ Compact traces ------------------ #
+
+def box_plot(groups, colors, xaxis_title='', yaxis_title='', compact=True, whis=1.5):
+    """
+    Build a box plot with one box per group. In compact mode, the boxes are drawn from statistics computed
+    with NumPy and only the outliers are embedded (as a WebGL scatter), instead of every data point.
+
+    Parameters:
+    - groups (dict): Dictionary mapping the name of each group to its data points.
+    - colors (list): Color of each box.
+    - xaxis_title (str): Title of the x axis.
+    - yaxis_title (str): Title of the y axis.
+    - compact (bool): Whether to draw the boxes from precomputed statistics.
+    - whis (float): Length of the whiskers in number of interquartile ranges.
+
+    Returns:
+    - go.Figure: The box plot. The boxes are the first traces, in the order of groups, so that
+                 add_p_value_annotation can be used with the same column indices. In compact mode, the
+                 groups without data points get no box (their category is kept on the x axis), so pass
+                 the data points of every group to add_p_value_annotation with samples.
+    """
+    fig = go.Figure()
+    outlier_traces = []
+    for (name, values), color in zip(groups.items(), colors):
+        if not compact:
+            fig.add_trace(go.Box(y=values, name=name, marker_color=color, jitter=0.3, pointpos=-1.8))
+            continue
+        stats = box_stats(values, whis)
+        if np.isnan(stats['median']):
+            # No data point in this group, nothing to draw
+            continue
+        fig.add_trace(go.Box(x=[name], name=name, marker_color=color, q1=[stats['q1']], median=[stats['median']],
+                             q3=[stats['q3']], lowerfence=[stats['lowerfence']], upperfence=[stats['upperfence']]))
+        outlier_traces.append(go.Scattergl(x=np.full(len(stats['outliers']), name), y=stats['outliers'],
+                                           mode='markers', marker_color=color, name=name, showlegend=False,
+                                           hoverinfo='y'))
+    fig.add_traces(outlier_traces)
+
+    fig.update_layout(xaxis=dict(categoryorder='array', categoryarray=list(groups), title=xaxis_title),
+                      yaxis_title=yaxis_title)
+    return fig
+
+
+def genre_counts_plot(genres, top=16, title='', xaxis_title='Genres', yaxis_title='Number of movie for each genre'):
+    """
+    Build a bar plot of the number of movies of the most frequent genres.
+
+    Parameters:
+    - genres (array-like): Genres of each movie (see parse_genres).
+    - top (int): Number of most frequent genres to show.
+    - title (str): Title of the plot.
+    - xaxis_title (str): Title of the x axis.
+    - yaxis_title (str): Title of the y axis.
+
+    Returns:
+    - go.Figure: The bar plot.
+    """
+    names, counts = genre_counts(genres, top)
+    fig = go.Figure(go.Bar(x=names, y=counts, marker_color='rgba(0, 158, 115, 0.5)'))
+    fig.update_layout(title=title, xaxis=dict(title=xaxis_title, tickangle=-90), yaxis_title=yaxis_title)
+    return fig
+
+
+def genre_gender_plot(genres, genders, female='F', male='M', title='Percentages of Women and Men by Movie Genre',
+                      xaxis_title='Movie Genre', yaxis_title='Percentage of character'):
+    """
+    Build a stacked bar plot of the percentages of women and men among the characters of each genre.
+
+    Parameters:
+    - genres (array-like): Genre of each character (one genre name per entry).
+    - genders (array-like): Gender of each character.
+    - female (str): Value of genders for women.
+    - male (str): Value of genders for men. The characters with another gender are left out.
+    - title (str): Title of the plot.
+    - xaxis_title (str): Title of the x axis.
+    - yaxis_title (str): Title of the y axis.
+
+    Returns:
+    - go.Figure: The bar plot.
+    """
+    names, percent_men, percent_women = genre_gender_percentages(genres, genders, female, male)
+    fig = go.Figure([go.Bar(x=names, y=percent_men, name='Men', marker_color='#80B1D3'),
+                     go.Bar(x=names, y=percent_women, name='Women', marker_color='#FB8072')])
+    fig.update_layout(barmode='stack', title=title, xaxis=dict(title=xaxis_title, tickangle=-45),
+                      yaxis_title=yaxis_title)
+    return fig
+
+# ------------------ Export ------------------ #
+
+def write_compact_html(fig, path, plotlyjs=PLOTLYJS, full_html=True):
+    """
+    Write a figure to an html file referencing a shared plotly.js instead of embedding it.
+
+    Parameters:
+    - fig (go.Figure): The figure.
+    - path (str): Path of the html file.
+    - plotlyjs (str): 'cdn' to load plotly.js from the plotly CDN, or a path to a shared plotly.min.js file
+                      relative to the html file.
+    - full_html (bool): Whether to write a standalone html page or only a <div> to include in the data story.
+    """
+    fig.write_html(path, include_plotlyjs=plotlyjs, full_html=full_html, config={'responsive': True})